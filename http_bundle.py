@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+import os
+import zlib
+import mmap
+import struct
+import hashlib
+import logging
+import datetime
+import posixpath
+from http_request_response import *
+
+# Bundle file layout:
+#   header | aligned bodies (plain and gzip variants) | strings | index
+# The index is a list of fixed-size entries sorted by path, so lookups are
+# a binary search directly over the mmap without loading anything into memory.
+
+BUNDLE_MAGIC = b'HTTPBNDL'
+BUNDLE_VERSION = 1
+BUNDLE_ALIGNMENT = 16
+
+# magic, version, entries count, index offset
+HEADER_FORMAT = '<8sIIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# strings offset, path length, mimetype length, etag length,
+# body offset, body length, gzip offset, gzip length
+ENTRY_FORMAT = '<QIHHQQQQ'
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+GZIP_MIMETYPES = ('text/html', 'text/css', 'text/plain', 'application/javascript')
+
+
+def to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def accepts_gzip(accept_encoding):
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        qvalue = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if name:
+            qvalues[name] = qvalue
+    # explicit gzip coding takes precedence over "*"
+    return qvalues.get('gzip', qvalues.get('x-gzip', qvalues.get('*', 0.0))) > 0
+
+
+class BundleError(Exception):
+    pass
+
+
+class BundleEntry:
+
+    path = None
+    content_type = None
+    etag = None
+
+    def __init__(self, bundle, path, content_type, etag, body_offset, body_length, gzip_offset, gzip_length):
+        self.bundle = bundle
+        self.path = path
+        self.content_type = content_type
+        self.etag = etag
+        self.body_offset = body_offset
+        self.body_length = body_length
+        self.gzip_offset = gzip_offset
+        self.gzip_length = gzip_length
+
+    def has_gzip(self):
+        return self.gzip_length > 0
+
+    def get_etag(self, gzipped=False):
+        # strong validator must differ between content-codings
+        if gzipped:
+            return self.etag[:-1] + b'-gzip"'
+        return self.etag
+
+    def get_length(self, gzipped=False):
+        return self.gzip_length if gzipped else self.body_length
+
+    def get_body(self, gzipped=False):
+        # view over the mmap, keeps the mapping alive until the body is sent
+        if gzipped:
+            return get_buffer(self.bundle.data, self.gzip_offset, self.gzip_length)
+        return get_buffer(self.bundle.data, self.body_offset, self.body_length)
+
+
+class Bundle:
+
+    path = None
+    data = None
+    count = 0
+    index_offset = 0
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER_SIZE:  # mmap can't map an empty file
+                raise BundleError('Bundle file is too short: %s' % path)
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.index_offset = struct.unpack_from(HEADER_FORMAT, self.data, 0)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            self.close()
+            raise BundleError('Not a bundle file or unsupported version: %s' % path)
+        if self.index_offset + self.count * ENTRY_SIZE > len(self.data):
+            self.close()
+            raise BundleError('Bundle index is truncated: %s' % path)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def get_path(self, position):
+        strings_offset, path_length = struct.unpack_from('<QI', self.data, self.index_offset + position * ENTRY_SIZE)
+        return self.data[strings_offset:strings_offset + path_length]
+
+    def get_entry(self, position):
+        (strings_offset, path_length, mime_length, etag_length,
+         body_offset, body_length, gzip_offset, gzip_length) = struct.unpack_from(
+            ENTRY_FORMAT, self.data, self.index_offset + position * ENTRY_SIZE)
+        mime_offset = strings_offset + path_length
+        etag_offset = mime_offset + mime_length
+        return BundleEntry(self,
+                           self.data[strings_offset:mime_offset],
+                           self.data[mime_offset:etag_offset],
+                           self.data[etag_offset:etag_offset + etag_length],
+                           body_offset, body_length, gzip_offset, gzip_length)
+
+    def find(self, path):
+        path = to_bytes(path)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.get_path(lo) == path:
+            return self.get_entry(lo)
+        return None
+
+    def lookup(self, uri, index_default):
+        # resolves request page the same way as ProcessHandler.get_validated_document_path does
+        if not uri or not uri.startswith('/'):
+            return None
+        path = posixpath.normpath('/' + uri.lstrip('/'))  # folding all /../../..
+        index_path = path.rstrip('/') + '/' + index_default
+        if uri[-1] == '/':  # for "...page.html/" case only directory index is allowed
+            return self.find(index_path)
+        return self.find(path) or self.find(index_path)
+
+
+class BundleResponse(Response):
+
+    entry = None
+    gzipped = False
+
+    def __init__(self, entry, request):
+        self.entry = entry
+        self.request = request
+        self.content_type = entry.content_type if entry else MIMETYPES['txt']
+        accept_encoding = request.headers.get('accept-encoding', '')
+        self.gzipped = bool(entry) and entry.has_gzip() and accepts_gzip(accept_encoding)
+
+    def get_content(self, entry, request):
+        if not entry:
+            msg = RESPONSE_CODE_MESSAGES[RESPONSE_CODE_404_NOT_FOUND]
+            return RESPONSE_CODE_404_NOT_FOUND, len(msg), msg
+        if request.method not in ALLOWED_METHODS:
+            return RESPONSE_CODE_405_METHOD_NOT_ALLOWED, 25, 'Method not supported yet!'
+        if request.method == METHOD_HEAD:
+            return RESPONSE_CODE_200_OK, entry.get_length(self.gzipped), ''
+        return RESPONSE_CODE_200_OK, entry.get_length(self.gzipped), entry.get_body(self.gzipped)
+
+    def prepare(self):
+        self.headers = dict(Response.headers)  # don't leak bundle headers into the shared class dict
+        if self.entry:
+            self.headers['ETag'] = self.entry.get_etag(self.gzipped)
+            if self.entry.has_gzip():
+                self.headers['Vary'] = 'Accept-Encoding'
+            if self.gzipped:
+                self.headers['Content-Encoding'] = 'gzip'
+        self.code, self.content_length, self.content = self.get_content(self.entry, self.request)
+        self.headers['Date'] = datetime.datetime.strftime(datetime.datetime.now(), "%a, %d %b %Y %H:%M:%S")
+        self.headers['Content-Type'] = self.content_type
+        self.headers['Content-Length'] = self.content_length
+
+    def get_response(self):
+        header = self.get_header()
+        return header + bytes(self.content)
+
+
+def build_bundle(document_root, bundle_path, use_gzip=False):
+    documents = []
+    tmp_path = '%s.%d.tmp' % (bundle_path, os.getpid())
+    for dir_path, dir_names, file_names in os.walk(document_root):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            if os.path.abspath(file_path) in (os.path.abspath(bundle_path), os.path.abspath(tmp_path)):
+                continue  # bundle is built inside the document root
+            uri = '/' + os.path.relpath(file_path, document_root).replace(os.sep, '/')
+            documents.append((uri, file_path))
+    documents.sort()
+
+    # write to a temporary file and rename it, so running servers never see a half written bundle
+    try:
+        with open(tmp_path, 'wb') as f:
+            count = write_bundle(f, documents, use_gzip)
+        os.rename(tmp_path, bundle_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    logging.info('Bundle %s built: %d documents from %s' % (bundle_path, count, document_root))
+    return count
+
+
+def write_bundle(f, documents, use_gzip=False):
+    entries = []
+    strings = b''
+    f.write(b'\0' * HEADER_SIZE)
+    for uri, file_path in documents:
+        with open(file_path, 'rb') as document:
+            content = document.read()
+        content_type = Response.get_mimetype(uri)
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        body_offset = write_aligned(f, content)
+        gzip_offset, gzip_length = 0, 0
+        if use_gzip and content_type in GZIP_MIMETYPES:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compressed = compressor.compress(content) + compressor.flush()
+            if len(compressed) < len(content):
+                gzip_offset, gzip_length = write_aligned(f, compressed), len(compressed)
+        entries.append((uri, content_type, etag, body_offset, len(content), gzip_offset, gzip_length))
+    strings_offset = f.tell()
+    index = b''
+    for uri, content_type, etag, body_offset, body_length, gzip_offset, gzip_length in entries:
+        uri, content_type, etag = to_bytes(uri), to_bytes(content_type), to_bytes(etag)
+        index += struct.pack(ENTRY_FORMAT, strings_offset + len(strings), len(uri), len(content_type), len(etag),
+                             body_offset, body_length, gzip_offset, gzip_length)
+        strings += uri + content_type + etag
+    f.write(strings)
+    index_offset = write_aligned(f, index)
+    f.seek(0)
+    f.write(struct.pack(HEADER_FORMAT, BUNDLE_MAGIC, BUNDLE_VERSION, len(entries), index_offset))
+    return len(entries)
+
+
+def write_aligned(f, data):
+    padding = -f.tell() % BUNDLE_ALIGNMENT
+    f.write(b'\0' * padding)
+    offset = f.tell()
+    f.write(data)
+    return offset
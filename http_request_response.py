@@ -49,6 +49,15 @@ MIMETYPES = {
 }
 
 
+def get_buffer(data, offset=0, size=None):
+    # slice of bytes or mmap without copying: buffer on python 2, memoryview on python 3
+    try:
+        return buffer(data, offset) if size is None else buffer(data, offset, size)
+    except NameError:
+        view = memoryview(data)[offset:]
+        return view if size is None else view[:size]
+
+
 class Request:
 
     header_raw = None
@@ -164,3 +173,7 @@ class Response:
     def get_response(self):
         response = self.get_header() + self.content
         return bytes(response)
+
+    def get_response_chunks(self):
+        # header and content are sent one after another, so the content is never copied into the response
+        return [self.get_header(), self.content]
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
 import time
+import errno
+import signal
 import socket
 import select
 import logging
 import argparse
 import multiprocessing
 from http_request_response import *
+from http_bundle import Bundle, BundleResponse, build_bundle
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -19,6 +22,9 @@ INDEX_DEFAULT = 'index.html'
 class ProcessHandler:
 
     document_root = None
+    bundle_path = None
+    bundle = None
+    bundle_reload = False
     serversocket = None
     epoll = None
 
@@ -26,9 +32,26 @@ class ProcessHandler:
     requests = {}
     responses = {}
 
-    def __init__(self, serversocket, document_root):
+    def __init__(self, serversocket, document_root, bundle_path=None):
         self.serversocket = serversocket
         self.document_root = document_root
+        self.bundle_path = bundle_path
+
+    def open_bundle(self):
+        self.bundle = Bundle(self.bundle_path)
+        logging.info('Worker PID=%d mapped bundle %s (%d documents)' % (os.getpid(), self.bundle_path, self.bundle.count))
+
+    def reload_bundle(self):
+        # bundle is replaced by rename, the old mapping is not closed here: bodies still being sent
+        # hold views over it and it is unmapped when the last of them is released
+        self.bundle_reload = False
+        try:
+            self.open_bundle()
+        except Exception as e:
+            logging.error('Bundle reload error, keep serving the old one: %s' % e)
+
+    def handle_sighup(self, signum, frame):
+        self.bundle_reload = True
 
     def get_validated_document_path(self, uri):
         if not uri:
@@ -51,7 +74,7 @@ class ProcessHandler:
         self.epoll.register(conn_fileno, select.EPOLLIN)
         self.connections[conn_fileno] = connection
         self.requests[conn_fileno] = b''
-        self.responses[conn_fileno] = b''
+        self.responses[conn_fileno] = []
         return conn_fileno
 
     def handle_recv(self, fileno):
@@ -72,25 +95,32 @@ class ProcessHandler:
             logging.debug('PPID: %d, PID: %d' % (os.getppid(), os.getpid()))
             logging.debug(request_header_raw)
             request = Request(request_header_raw)
-            document_path = self.get_validated_document_path(request.page)
-            response = Response(document_path, request)
-            self.responses[fileno] = response.get_response()
+            if self.bundle:
+                response = BundleResponse(self.bundle.lookup(request.page, INDEX_DEFAULT), request)
+            else:
+                document_path = self.get_validated_document_path(request.page)
+                response = Response(document_path, request)
+            self.responses[fileno] = [chunk for chunk in response.get_response_chunks() if len(chunk)]
             logging.info("%s %s %d" % (METHOD_SIGNATURES[request.method], request.uri, response.code))
 
     def handle_send(self, fileno):
         try:
-            bytessent = self.connections[fileno].send(self.responses[fileno])
+            bytessent = self.connections[fileno].send(self.responses[fileno][0])
         except Exception as e:
             logging.debug('Sending error: %s' % e)
             self.connections[fileno].setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
             self.epoll.modify(fileno, 0)
             self.connections[fileno].close()
             del self.connections[fileno]
+            self.responses[fileno] = []  # release the views over the bundle
             return
 
         logging.debug('Sent total: %d bytes' % bytessent)
-        self.responses[fileno] = self.responses[fileno][bytessent:]
-        if len(self.responses[fileno]) == 0:
+        if bytessent < len(self.responses[fileno][0]):
+            self.responses[fileno][0] = get_buffer(self.responses[fileno][0], bytessent)
+        else:
+            self.responses[fileno].pop(0)
+        if not self.responses[fileno]:
             self.connections[fileno].setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
             self.epoll.modify(fileno, 0)
             self.connections[fileno].shutdown(socket.SHUT_RDWR)
@@ -99,11 +129,20 @@ class ProcessHandler:
 
     def run(self):
         logging.info('Worker started! PID=%d' % os.getpid())
+        if self.bundle_path:
+            self.open_bundle()
         self.epoll = select.epoll()
         self.epoll.register(self.serversocket.fileno(), select.EPOLLIN)
         try:
             while True:
-                events = self.epoll.poll(1)
+                if self.bundle_reload:
+                    self.reload_bundle()
+                try:
+                    events = self.epoll.poll(1)
+                except IOError as e:  # interrupted by SIGHUP
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
                 for fileno, event in events:
                     if fileno == self.serversocket.fileno():
                         self.handle_new_connection()
@@ -131,6 +170,7 @@ class HTTPServer(object):
 
     name = SERVER_NAME
     document_root = None
+    bundle_path = None
     server_addr = None
     server_port = None
 
@@ -142,9 +182,10 @@ class HTTPServer(object):
     requests = {}
     responses = {}
 
-    def __init__(self, server_addr, server_port, document_root, workers_count=1):
+    def __init__(self, server_addr, server_port, document_root, workers_count=1, bundle_path=None):
 
         self.document_root = document_root
+        self.bundle_path = bundle_path
         self.server_addr = server_addr
         self.server_port = server_port
         self.workers_count = workers_count
@@ -155,16 +196,33 @@ class HTTPServer(object):
         self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     def start(self):
+        if self.bundle_path:  # default SIGHUP action would kill the server during startup
+            signal.signal(signal.SIGHUP, self.handle_sighup)
         self.serversocket.bind((self.server_addr, self.server_port))
         self.serversocket.listen(5)
         self.serversocket.setblocking(0)
         self.serversocket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        if self.bundle_path:
+            Bundle(self.bundle_path).close()  # fail fast on a broken bundle before starting workers
 
         for i in range(self.workers_count):
-            process_handler = ProcessHandler(self.serversocket, self.document_root)
+            process_handler = ProcessHandler(self.serversocket, self.document_root, self.bundle_path)
             worker = multiprocessing.Process(target=process_handler.run)
             worker.deamon = True
-            worker.start()
+            if self.bundle_path:  # worker inherits its SIGHUP handler with the fork
+                signal.signal(signal.SIGHUP, process_handler.handle_sighup)
+                worker.start()
+                signal.signal(signal.SIGHUP, self.handle_sighup)
+            else:
+                worker.start()
+
+    def reload(self):
+        logging.info("Reloading bundle %s" % self.bundle_path)
+        for process in multiprocessing.active_children():
+            os.kill(process.pid, signal.SIGHUP)
+
+    def handle_sighup(self, signum, frame):
+        self.reload()
 
     def shutdown(self):
         try:
@@ -187,15 +245,22 @@ if __name__ == '__main__':
     parser.add_argument("-p", "--port", default=SERVER_PORT, help="server port", type=int)
     parser.add_argument("-l", "--log", default=None, help='log file')
     parser.add_argument("-d", "--debug", default=False, help='debug level log', action="store_true")
+    parser.add_argument("-b", "--bundle", default=None, help='serve documents from bundle file, SIGHUP reloads it')
+    parser.add_argument("--build-bundle", default=None, help='pack document root into bundle file and exit')
+    parser.add_argument("--gzip", default=False, help='store gzip variants in built bundle', action="store_true")
     settings = parser.parse_args()
 
     logging.basicConfig(filename=settings.log, level=logging.INFO if not settings.debug else logging.DEBUG,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    if settings.build_bundle:
+        build_bundle(settings.root, settings.build_bundle, settings.gzip)
+        exit(0)
     logging.info('Starting server at %s:%d ...' % (settings.host, settings.port))
     server = HTTPServer(server_addr=settings.host,
                         server_port=settings.port,
                         document_root=settings.root,
-                        workers_count=settings.workers)
+                        workers_count=settings.workers,
+                        bundle_path=settings.bundle)
     try:
         server.start()
         while True:  # for 'finally' section
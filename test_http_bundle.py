@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import zlib
+import shutil
+import tempfile
+import unittest
+from http_bundle import *
+
+INDEX_DEFAULT = 'index.html'
+PAGE = b'<html>' + b'page ' * 100 + b'</html>\n'
+
+
+class BundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.document_root = os.path.join(self.tmp_dir, 'root')
+        self.bundle_path = os.path.join(self.tmp_dir, 'root.bundle')
+        os.makedirs(os.path.join(self.document_root, 'dir', 'empty'))
+        self.write('dir/page.html', PAGE)
+        self.write('dir/index.html', b'<html>index</html>\n')
+        self.write('dir/empty/file.txt', b'file\n')
+        self.write('logo.png', b'\x89PNG\r\n\x1a\n')
+        build_bundle(self.document_root, self.bundle_path, use_gzip=True)
+        self.bundle = Bundle(self.bundle_path)
+
+    def tearDown(self):
+        self.bundle.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, content):
+        with open(os.path.join(self.document_root, path), 'wb') as f:
+            f.write(content)
+
+    def test_find(self):
+        entry = self.bundle.find('/dir/page.html')
+        self.assertEqual(bytes(entry.get_body()), PAGE)
+        self.assertEqual(entry.content_type, b'text/html')
+        self.assertEqual(self.bundle.find('/logo.png').content_type, b'image/png')
+        self.assertIsNone(self.bundle.find('/dir/page.htm'))
+
+    def test_lookup(self):
+        self.assertEqual(self.bundle.lookup('/dir/page.html', INDEX_DEFAULT).path, b'/dir/page.html')
+        self.assertEqual(self.bundle.lookup('/dir/', INDEX_DEFAULT).path, b'/dir/index.html')
+        self.assertEqual(self.bundle.lookup('/dir', INDEX_DEFAULT).path, b'/dir/index.html')
+        self.assertEqual(self.bundle.lookup('/../../dir/../logo.png', INDEX_DEFAULT).path, b'/logo.png')
+        self.assertIsNone(self.bundle.lookup('/dir/page.html/', INDEX_DEFAULT))
+        self.assertIsNone(self.bundle.lookup('/dir/empty/', INDEX_DEFAULT))
+        self.assertIsNone(self.bundle.lookup('/../../../etc/passwd', INDEX_DEFAULT))
+        self.assertIsNone(self.bundle.lookup('/missing.html', INDEX_DEFAULT))
+        self.assertIsNone(self.bundle.lookup(None, INDEX_DEFAULT))
+
+    def test_gzip_variant(self):
+        entry = self.bundle.find('/dir/page.html')
+        self.assertTrue(entry.has_gzip())
+        self.assertEqual(zlib.decompress(bytes(entry.get_body(gzipped=True)), 16 + zlib.MAX_WBITS), PAGE)
+        self.assertNotEqual(entry.get_etag(gzipped=True), entry.get_etag())
+        self.assertFalse(self.bundle.find('/logo.png').has_gzip())  # binary types are not compressed
+        self.assertFalse(self.bundle.find('/dir/empty/file.txt').has_gzip())  # gzip would be larger
+
+    def test_accepts_gzip(self):
+        self.assertTrue(accepts_gzip('gzip, deflate'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip(''))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('*;q=0.5, gzip;q=0'))
+
+    def test_bad_magic(self):
+        with open(self.bundle_path, 'r+b') as f:
+            f.write(b'NOTBUNDL')
+        self.assertRaises(BundleError, Bundle, self.bundle_path)
+
+    def test_truncated_index(self):
+        with open(self.bundle_path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.bundle_path) - 1)
+        self.assertRaises(BundleError, Bundle, self.bundle_path)
+
+    def test_empty_file(self):
+        open(self.bundle_path, 'wb').close()
+        self.assertRaises(BundleError, Bundle, self.bundle_path)
+
+    def test_failed_build_removes_temporary_file(self):
+        os.symlink(os.path.join(self.tmp_dir, 'missing'), os.path.join(self.document_root, 'broken.txt'))
+        self.assertRaises(IOError, build_bundle, self.document_root, self.bundle_path)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['root', 'root.bundle'])
+
+
+if __name__ == '__main__':
+    unittest.main()